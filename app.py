@@ -1,7 +1,20 @@
+import argparse
+import asyncio
+import http.client
 import os
 import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlsplit
 from pytubefix import YouTube
-from pytubefix.cli import on_progress
 
 # Try to import Playlist (it may be available at the top level or via a contrib package)
 try:
@@ -9,44 +22,561 @@ try:
 except ImportError:
     from pytubefix.contrib.playlist import Playlist
 
+# Number of playlist videos downloaded at the same time (1 = one after another)
+MAX_PARALLEL = 4
+# Number of playlist videos whose metadata is fetched ahead of the downloads
+METADATA_WORKERS = 16
+# Number of concurrent byte-range requests used to fetch a single stream
+DOWNLOAD_CHUNKS = 8
+# Size of the blocks read from each range response
+READ_BLOCK_SIZE = 64 * 1024
+# Maximum number of idle keep-alive connections kept per host
+HTTP_POOL_SIZE = 32
+# Socket timeout (seconds) for stream downloads
+HTTP_TIMEOUT = 30
+# Minimum time (seconds) and progress (fraction) between two progress bar redraws
+PROGRESS_INTERVAL = 0.1
+PROGRESS_MIN_DELTA = 0.01
+# Seconds between two status lines, printed instead of a progress bar while
+# downloading in parallel or while FFmpeg muxes straight from stream URLs
+STATUS_INTERVAL = 5
+# Stream lists longer than this are filtered with NumPy, if it is installed
+NUMPY_MIN_STREAMS = 64
+
+# FFmpeg error messages meaning a stream could not be copied into the output as-is
+_CODEC_ERRORS = (
+    "Invalid data",
+    "Could not find tag for codec",
+    "not currently supported in container",
+    "incorrect codec parameters",
+)
+# FFmpeg error messages meaning an input file is corrupt or truncated
+_INPUT_ERRORS = (
+    "Invalid data",
+    "moov atom not found",
+)
+# Leading number of a resolution ('720p') or bitrate ('128kbps') string
+_LEADING_INT_RE = re.compile(r"(\d+)")
+# Idle keep-alive HTTP connections, keyed by (scheme, host)
+_idle_connections = {}
+_pool_lock = threading.Lock()
+# pytubefix.cli.on_progress, imported by throttled_on_progress on first use
+_on_progress = None
+# Last progress bar redraw per stream: id(stream) -> (timestamp, fraction done)
+_last_progress = {}
+# id() of the stream that currently owns the single progress bar line
+_bar_owner = None
+_bar_lock = threading.Lock()
+# Last status line per stream: id(stream) -> timestamp
+_last_status = {}
+# Folders already created by ensure_folder during this run
+_created_folders = set()
+# Whether FFmpeg was built with NVENC support (detected on first use)
+_NVENC_AVAILABLE = None
+
+# Translation table for safe_name: drop characters not allowed in filenames
+_SAFE_TBL = str.maketrans("", "", '\\/*?:"<>|')
+
 # --- Helper Functions ---
 
 def safe_name(name, max_length=255):
     """
     Sanitize a string to be safe as a filename or folder name.
     """
-    safe = re.sub(r'[\\/*?:"<>|]', "", name)
-    safe = safe.strip().replace(" ", "_")
-    return safe[:max_length]
+    return name.translate(_SAFE_TBL).strip().replace(" ", "_")[:max_length]
+
+def throttled_on_progress(stream, chunk, bytes_remaining):
+    """
+    Drop-in replacement for pytubefix's on_progress that redraws the progress
+    bar at most every PROGRESS_INTERVAL seconds and only after at least
+    PROGRESS_MIN_DELTA of the stream has arrived. The final chunk is always shown.
+    When streams download at the same time (video and audio for a merge), only
+    the first one draws the bar until it finishes; the others stay silent.
+    """
+    global _on_progress, _bar_owner
+    if _on_progress is None:
+        # pytubefix.cli is only needed once a download actually starts
+        from pytubefix.cli import on_progress as _on_progress
+    
+    key = id(stream)
+    with _bar_lock:
+        if _bar_owner is None:
+            _bar_owner = key
+        elif _bar_owner != key:
+            return
+    if bytes_remaining <= 0:
+        _last_progress.pop(key, None)
+        _on_progress(stream, chunk, bytes_remaining)
+        with _bar_lock:
+            _bar_owner = None
+        return
+    now = time.monotonic()
+    done = 1 - bytes_remaining / stream.filesize if stream.filesize else 0
+    last_time, last_done = _last_progress.get(key, (None, None))
+    if last_time is not None and (
+        now - last_time < PROGRESS_INTERVAL or done - last_done < PROGRESS_MIN_DELTA
+    ):
+        return
+    _last_progress[key] = (now, done)
+    _on_progress(stream, chunk, bytes_remaining)
+
+def forget_progress(stream):
+    """
+    Drop the progress state kept for stream and give up the progress bar line
+    if it owns it (e.g. its download failed or is restarting from zero).
+    """
+    global _bar_owner
+    key = id(stream)
+    _last_progress.pop(key, None)
+    _last_status.pop(key, None)
+    with _bar_lock:
+        if _bar_owner == key:
+            _bar_owner = None
+
+def status_on_progress(stream, chunk, bytes_remaining):
+    """
+    Progress callback for downloads running in parallel: instead of redrawing
+    a shared progress bar, print a plain status line for each stream every
+    STATUS_INTERVAL seconds.
+    """
+    key = id(stream)
+    now = time.monotonic()
+    if bytes_remaining <= 0:
+        _last_status.pop(key, None)
+        return
+    last = _last_status.setdefault(key, now)
+    if now - last < STATUS_INTERVAL:
+        return
+    _last_status[key] = now
+    size = stream.filesize or 0
+    percent = f"{100 * (size - bytes_remaining) / size:.0f}% of " if size else ""
+    print(f"Downloading {getattr(stream, 'title', '')} ({getattr(stream, 'type', 'stream')}): "
+          f"{percent}{size / (1024 * 1024):.1f} MiB")
+
+def remove_quietly(path):
+    """
+    Delete a leftover partial file, ignoring the case where it does not exist.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def ensure_folder(path):
+    """
+    Create a folder (and its parents) unless it was already created during this run.
+    """
+    if path not in _created_folders:
+        os.makedirs(path, exist_ok=True)
+        _created_folders.add(path)
+    return path
 
-def merge_video_audio(video_path, audio_path, output_path):
+def merge_video_audio(video_path, audio_path, output_path, audio_codec=None):
     """
     Merge video and audio files using FFmpeg.
-    This version re-encodes the audio to AAC at 128kbps and 48000Hz.
+    
+    Both streams are copied as-is (a remux), which is enough for the usual
+    AAC audio from YouTube. If audio_codec is known not to be AAC (e.g. Opus),
+    or FFmpeg reports a codec error on the copy, the audio is re-encoded to
+    AAC at 128kbps instead. If that still fails on a codec error (and not on
+    corrupt input), the video is re-encoded with NVENC when the GPU supports it.
+    Returns output_path, or None if merging failed.
     """
-    command = (
-        f'ffmpeg -y -i "{video_path}" -i "{audio_path}" '
-        f'-c:v copy -c:a aac -b:a 128k -ar 48000 "{output_path}"'
-    )
-    print("Running FFmpeg command:")
-    print(command)
-    ret = os.system(command)
+    aac_args = ["-c:a", "aac", "-b:a", "128k"]
+    copy_audio = audio_codec is None or audio_codec.startswith("mp4a")
+    if copy_audio:
+        ret, err = run_ffmpeg_merge(video_path, audio_path, output_path, ["-c:a", "copy"])
+        if ret != 0 and is_codec_error(err):
+            print("Stream copy failed, re-encoding audio to AAC...")
+            copy_audio = False
+    if not copy_audio:
+        ret, err = run_ffmpeg_merge(video_path, audio_path, output_path, aac_args)
+    if ret != 0 and is_codec_error(err) and not is_input_error(err) and nvenc_available():
+        print("Remux failed, re-encoding video on the GPU...")
+        ret, err = merge_video_audio_gpu(video_path, audio_path, output_path, aac_args)
     if ret != 0:
         print("FFmpeg merging failed!")
-    else:
-        print("Merging complete!")
+        print(err.strip())
+        return None
+    print("Merging complete!")
     return output_path
 
-def res_to_int(res):
+def merge_from_urls(video_url, audio_url, output_path, audio_codec=None, duration=None, label=None):
+    """
+    Let FFmpeg read the video and audio streams straight from their URLs and
+    mux them into output_path in one pass, without writing intermediate files.
+    A status line naming label (default: the output file name) is printed every
+    STATUS_INTERVAL seconds; duration (in seconds), if known, is shown as the total.
+    Returns True on success; False means the caller should fall back to
+    downloading the streams first (e.g. the URLs returned 403).
+    """
+    reconnect_args = ["-reconnect", "1", "-reconnect_streamed", "1"]
+    copy_audio = audio_codec is None or audio_codec.startswith("mp4a")
+    audio_args = ["-c:a", "copy"] if copy_audio else ["-c:a", "aac", "-b:a", "128k"]
+    argv = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error", "-progress", "pipe:1",
+        *reconnect_args, "-i", video_url,
+        *reconnect_args, "-i", audio_url,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", *audio_args, "-movflags", "+faststart", output_path
+    ]
+    ret, err = run_ffmpeg_with_status(argv, label or os.path.basename(output_path), duration)
+    if ret != 0:
+        reason = err.strip().splitlines()[-1] if err.strip() else f"exit status {ret}"
+        print("Direct merge from stream URLs failed:", reason)
+        return False
+    print("Merging complete!")
+    return True
+
+def merge_video_audio_gpu(video_path, audio_path, output_path, audio_args=("-c:a", "copy")):
+    """
+    Merge video and audio files, re-encoding the video to H.264 with NVENC.
+    Returns a tuple of the FFmpeg exit status and its error output.
+    """
+    return run_ffmpeg_merge(
+        video_path, audio_path, output_path, audio_args,
+        video_args=["-c:v", "h264_nvenc", "-preset", "p1", "-rc", "vbr", "-cq", "24"],
+        input_args=["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+    )
+
+def nvenc_available():
+    """
+    Check once whether the installed FFmpeg provides the h264_nvenc encoder.
+    """
+    global _NVENC_AVAILABLE
+    if _NVENC_AVAILABLE is None:
+        try:
+            result = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-encoders"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True
+            )
+            _NVENC_AVAILABLE = "h264_nvenc" in result.stdout
+        except OSError:
+            _NVENC_AVAILABLE = False
+    return _NVENC_AVAILABLE
+
+def is_codec_error(stderr):
+    """
+    Tell whether FFmpeg's error output points at a codec/container mismatch,
+    i.e. a failure that re-encoding can fix.
+    """
+    return any(msg in stderr for msg in _CODEC_ERRORS)
+
+def is_input_error(stderr):
+    """
+    Tell whether FFmpeg's error output points at a corrupt or truncated input,
+    which no amount of re-encoding can fix.
+    """
+    return any(msg in stderr for msg in _INPUT_ERRORS)
+
+def run_ffmpeg_merge(video_path, audio_path, output_path, audio_args,
+                     video_args=("-c:v", "copy"), input_args=()):
+    """
+    Run a single FFmpeg merge with the given video and audio options.
+    Returns a tuple of the FFmpeg exit status and its error output.
+    """
+    argv = [
+        "ffmpeg", "-y", *input_args, "-i", video_path, "-i", audio_path,
+        *video_args, *audio_args, "-movflags", "+faststart", output_path
+    ]
+    return run_ffmpeg(argv)
+
+def run_ffmpeg(argv):
+    """
+    Run FFmpeg with the given argument list.
+    Returns a tuple of the FFmpeg exit status and its error output.
+    """
+    print("Running FFmpeg command:")
+    print(subprocess.list2cmdline(argv))
+    try:
+        result = subprocess.run(
+            argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            universal_newlines=True, errors="replace", check=False
+        )
+    except OSError as e:
+        return -1, str(e)
+    return result.returncode, result.stderr
+
+def _format_seconds(seconds):
+    """
+    Format a number of seconds as M:SS (or H:MM:SS).
+    """
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+def run_ffmpeg_with_status(argv, label, duration=None):
+    """
+    Run FFmpeg with an argument list that includes '-progress pipe:1' and
+    print a status line for label every STATUS_INTERVAL seconds.
+    Returns a tuple of the FFmpeg exit status and its error output.
+    """
+    print("Running FFmpeg command:")
+    print(subprocess.list2cmdline(argv))
+    # stderr goes to a file so it can never fill a pipe while stdout is read
+    with tempfile.TemporaryFile() as err_file:
+        try:
+            proc = subprocess.Popen(
+                argv, stdout=subprocess.PIPE, stderr=err_file,
+                universal_newlines=True, errors="replace"
+            )
+        except OSError as e:
+            return -1, str(e)
+        out_seconds = 0
+        size = 0
+        last_status = time.monotonic()
+        with proc.stdout:
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and value.isdigit():
+                    out_seconds = int(value) / 1e6
+                elif key == "total_size" and value.isdigit():
+                    size = int(value)
+                elif key == "progress" and time.monotonic() - last_status >= STATUS_INTERVAL:
+                    last_status = time.monotonic()
+                    total = f" / {_format_seconds(duration)}" if duration else ""
+                    print(f"Muxing {label}: {_format_seconds(out_seconds)}{total} "
+                          f"({size / (1024 * 1024):.1f} MiB)")
+        ret = proc.wait()
+        err_file.seek(0)
+        return ret, err_file.read().decode(errors="replace")
+
+def _new_connection(scheme, netloc):
+    """
+    Open a new HTTP(S) connection to the host.
+    """
+    conn_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    return conn_class(netloc, timeout=HTTP_TIMEOUT)
+
+def _acquire_connection(scheme, netloc):
+    """
+    Take an idle connection to the host from the pool, or open a new one.
+    Returns a tuple (connection, reused) where reused tells whether it came
+    from the pool.
+    """
+    with _pool_lock:
+        idle = _idle_connections.get((scheme, netloc))
+        if idle:
+            return idle.pop(), True
+    return _new_connection(scheme, netloc), False
+
+def _release_connection(scheme, netloc, conn):
+    """
+    Return a connection to the pool so a later request can reuse it.
+    """
+    with _pool_lock:
+        idle = _idle_connections.setdefault((scheme, netloc), [])
+        if len(idle) < HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+@contextmanager
+def pooled_request(url, method="GET", headers=None, max_redirects=5):
+    """
+    Send an HTTP request over a pooled keep-alive connection and yield the response.
+    
+    Reusing connections saves a TCP and TLS handshake for every request after
+    the first one to a host. Redirects are followed. If the response body has
+    been read completely when the block exits, the connection goes back to
+    the pool; otherwise it is closed.
+    Raises urllib.error.HTTPError for error responses (status >= 400).
+    """
+    for redirects in range(max_redirects + 1):
+        parts = urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        conn, reused = _acquire_connection(parts.scheme, parts.netloc)
+        try:
+            conn.request(method, path, headers=headers or {})
+            resp = conn.getresponse()
+        except (http.client.HTTPException, ConnectionError, ssl.SSLError):
+            conn.close()
+            if not reused:
+                raise
+            # A pooled connection may have been closed by the server (or its TLS
+            # session dropped); retry once on a fresh one
+            conn = _new_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=headers or {})
+                resp = conn.getresponse()
+            except BaseException:
+                conn.close()
+                raise
+        location = resp.getheader("Location")
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            resp.read()
+            if redirects == max_redirects:
+                conn.close()
+                raise HTTPError(url, resp.status, "Too many redirects", resp.headers, None)
+            _release_connection(parts.scheme, parts.netloc, conn)
+            url = urljoin(url, location)
+            continue
+        break
+    
+    try:
+        if resp.status >= 400:
+            raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+        yield resp
+    finally:
+        if resp.isclosed() and not resp.will_close:
+            _release_connection(parts.scheme, parts.netloc, conn)
+        else:
+            conn.close()
+
+def ranged_download(url, size, out_path, chunks=DOWNLOAD_CHUNKS, on_chunk=None):
     """
-    Convert a resolution string like '720p' to an integer (e.g. 720).
+    Download url into out_path using several concurrent HTTP Range requests.
+    
+    YouTube throttles each connection separately, so fetching the file as
+    `chunks` byte ranges in parallel multiplies the effective throughput.
+    If size is unknown it is read from a HEAD request. on_chunk, if given, is
+    called as on_chunk(chunk, bytes_remaining) after every block is written.
+    The data is written to out_path + ".part" and only renamed to out_path once
+    complete, so an interrupted download never looks finished.
+    Raises urllib.error.HTTPError when the server rejects a request (e.g. 403).
     """
-    if res is None:
-        return 0
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if not size:
+        with pooled_request(url, "HEAD", headers) as resp:
+            size = int(resp.getheader("Content-Length") or 0)
+            resp.read()
+    if size <= 0:
+        raise ValueError("Unknown content length")
+    
+    part_path = out_path + ".part"
+    # Pre-allocate the file so every range can be written in place
+    with open(part_path, "wb") as f:
+        f.truncate(size)
+    
+    part = -(-size // max(1, chunks))
+    ranges = [(start, min(start + part, size) - 1) for start in range(0, size, part)]
+    lock = threading.Lock()
+    remaining = [size]
+    
+    def fetch_range(start, end):
+        range_headers = dict(headers, Range=f"bytes={start}-{end}")
+        with pooled_request(url, "GET", range_headers) as resp, open(part_path, "r+b") as f:
+            if resp.status != 206:
+                raise ValueError(f"Server ignored range request (HTTP {resp.status})")
+            f.seek(start)
+            written = 0
+            while True:
+                block = resp.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+                if on_chunk is not None:
+                    with lock:
+                        remaining[0] -= len(block)
+                        on_chunk(block, remaining[0])
+        if written != end - start + 1:
+            raise ValueError(f"Incomplete range {start}-{end}: got {written} bytes")
+    
     try:
-        return int(res.rstrip("p"))
-    except Exception:
-        return 0
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(fetch_range, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+    except BaseException:
+        remove_quietly(part_path)
+        raise
+    os.replace(part_path, out_path)
+    return out_path
+
+def download_stream(stream, output_path, filename=None):
+    """
+    Download a pytubefix stream using ranged_download.
+    
+    Falls back to pytubefix's own single-connection download if the ranged
+    fetch fails (e.g. HTTP 403 on an expired or throttled URL). Either way the
+    file only appears under its final name once it is complete.
+    """
+    filename = filename or stream.default_filename
+    out_path = os.path.join(output_path, filename)
+    # Report progress through the callback registered on the YouTube object
+    on_progress_callback = getattr(getattr(stream, "_monostate", None), "on_progress", None)
+    
+    def on_chunk(chunk, bytes_remaining):
+        if on_progress_callback is not None:
+            on_progress_callback(stream, chunk, bytes_remaining)
+    
+    try:
+        try:
+            return ranged_download(stream.url, stream.filesize, out_path, on_chunk=on_chunk)
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            print("Ranged download failed, retrying with a single connection:", e)
+            forget_progress(stream)
+        # pytubefix writes straight to the name it is given, so download into a
+        # temporary folder next to the target and move the file once it is done
+        with tempfile.TemporaryDirectory(dir=output_path) as tmp_folder:
+            tmp_path = stream.download(output_path=tmp_folder, filename=filename)
+            os.replace(tmp_path, out_path)
+        return out_path
+    except BaseException:
+        forget_progress(stream)
+        raise
+
+@lru_cache(maxsize=4096)
+def _leading_int(value):
+    """
+    Convert the leading number of a string like '720p' or '128kbps' to an
+    integer (e.g. 720 or 128), or 0 if there is none.
+    """
+    m = _LEADING_INT_RE.match(value or "")
+    return int(m.group(1)) if m else 0
+
+# Resolutions ('720p') and audio bitrates ('128kbps') are parsed the same way
+_res_int = _leading_int
+_abr_int = _leading_int
+
+def _best_resolution_group_py(video_streams, max_res=1080):
+    """
+    Pure-Python version of best_resolution_group.
+    """
+    # Filter streams with a defined resolution that are ≤ max_res
+    filtered = [s for s in video_streams if s.resolution and _res_int(s.resolution) <= max_res]
+    if not filtered:
+        return []
+    # Find the best available resolution (a single pass, no sort needed)
+    best_res = max(_res_int(s.resolution) for s in filtered)
+    return [s for s in filtered if _res_int(s.resolution) == best_res]
+
+def best_resolution_group(video_streams, max_res=1080):
+    """
+    Return the video streams that have the highest resolution up to max_res,
+    in their original order (empty if none qualifies).
+    
+    Very long stream lists are handled with NumPy when it is available; it is
+    imported only then, so small lists don't pay the import cost. Both paths
+    must pick the same streams (run `python -m doctest app.py`):
+    
+    >>> from types import SimpleNamespace
+    >>> streams = [SimpleNamespace(resolution=r)
+    ...            for r in ["360p", None, "1080p60", "2160p", "720p", "1080p"] * 20]
+    >>> len(streams) > NUMPY_MIN_STREAMS
+    True
+    >>> best = best_resolution_group(streams)
+    >>> best == _best_resolution_group_py(streams), len(best)
+    (True, 40)
+    >>> best_resolution_group(streams, max_res=240) == _best_resolution_group_py(streams, max_res=240) == []
+    True
+    """
+    if len(video_streams) > NUMPY_MIN_STREAMS:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        if np is not None:
+            count = len(video_streams)
+            res = np.fromiter((_res_int(s.resolution) for s in video_streams), dtype=np.int16, count=count)
+            has_res = np.fromiter((bool(s.resolution) for s in video_streams), dtype=bool, count=count)
+            mask = has_res & (res <= max_res)
+            if not mask.any():
+                return []
+            best_idx = np.flatnonzero(mask & (res == res[mask].max()))
+            return [video_streams[i] for i in best_idx]
+    return _best_resolution_group_py(video_streams, max_res)
 
 def choose_best_video_combo(yt):
     """
@@ -65,42 +595,26 @@ def choose_best_video_combo(yt):
       - or "merge" if separate streams need to be downloaded and merged.
       - When mode is "merge", audio_stream is not None.
     """
+    # Build the stream list once; every yt.streams access rebuilds the StreamQuery
+    all_streams = list(yt.streams)
     # Get all video streams (both progressive and video-only)
-    video_streams = [s for s in yt.streams if s.mime_type.startswith("video")]
-    # Filter streams with a defined resolution that are ≤ 1080p
-    filtered = [s for s in video_streams if s.resolution and res_to_int(s.resolution) <= 1080]
-    if not filtered:
+    video_streams = [s for s in all_streams if s.mime_type.startswith("video")]
+    # Group the streams that have the best available resolution ≤ 1080p
+    best_group = best_resolution_group(video_streams)
+    if not best_group:
         return None, None, None
 
-    # Sort descending by resolution
-    filtered.sort(key=lambda s: res_to_int(s.resolution), reverse=True)
-    best_res = res_to_int(filtered[0].resolution)
-    # Group streams that have the best available resolution
-    best_group = [s for s in filtered if res_to_int(s.resolution) == best_res]
-
     # If any in best_group are progressive (include audio), choose the one with highest audio bitrate.
     progressive_streams = [s for s in best_group if getattr(s, "includes_audio_track", False)]
     if progressive_streams:
-        def audio_bitrate(s):
-            try:
-                return int(s.abr.rstrip("kbps")) if s.abr and s.abr.rstrip("kbps").isdigit() else 0
-            except Exception:
-                return 0
-        progressive_streams.sort(key=audio_bitrate, reverse=True)
-        return "progressive", progressive_streams[0], None
+        return "progressive", max(progressive_streams, key=lambda s: _abr_int(s.abr)), None
     else:
         # Otherwise, use the best video-only stream from best_group.
         best_video = best_group[0]
         # Then choose the best audio-only stream by bitrate.
-        audio_streams = list(yt.streams.filter(only_audio=True))
+        audio_streams = [s for s in all_streams if s.mime_type.startswith("audio")]
         if audio_streams:
-            def audio_bitrate(s):
-                try:
-                    return int(s.abr.rstrip("kbps")) if s.abr and s.abr.rstrip("kbps").isdigit() else 0
-                except Exception:
-                    return 0
-            audio_streams.sort(key=audio_bitrate, reverse=True)
-            best_audio = audio_streams[0]
+            best_audio = max(audio_streams, key=lambda s: _abr_int(s.abr))
         else:
             best_audio = None
         return "merge", best_video, best_audio
@@ -111,8 +625,7 @@ def download_single_video_manual(yt, base_folder):
     """
     For a single video, display all available streams for manual selection.
     """
-    video_folder = os.path.join(base_folder, safe_name(yt.title))
-    os.makedirs(video_folder, exist_ok=True)
+    video_folder = ensure_folder(os.path.join(base_folder, safe_name(yt.title)))
     
     print("\nAvailable Streams:")
     streams = list(yt.streams)
@@ -132,29 +645,52 @@ def download_single_video_manual(yt, base_folder):
     
     print(f"\nDownloading selected stream (Itag {chosen_stream.itag})...")
     try:
-        chosen_stream.download(output_path=video_folder)
+        download_stream(chosen_stream, video_folder)
         print("Download complete!")
     except Exception as e:
         print("Error during download:", e)
 
-def download_single_video_auto(yt, mode, base_folder):
+def already_downloaded(path):
+    """
+    Tell whether a previously downloaded file exists at path and is not empty.
+    """
+    try:
+        return os.path.getsize(path) > 0
+    except OSError:
+        return False
+
+def download_single_video_auto(yt, mode, base_folder, pre_safe_title=None, skip_existing=True):
     """
     Automatic download for a single video.
     
     If mode is "audio": downloads the best audio-only stream.
     If mode is "video": automatically selects the best video+audio combination using choose_best_video_combo.
+    pre_safe_title may be passed in if safe_name(yt.title) has already been computed.
+    With skip_existing, nothing is downloaded if the final file is already there.
     """
-    video_folder = os.path.join(base_folder, safe_name(yt.title))
-    os.makedirs(video_folder, exist_ok=True)
+    base = pre_safe_title if pre_safe_title is not None else safe_name(yt.title)
+    video_folder = os.path.join(base_folder, base)
+    # All file names derive from base; build each of them once
+    audio_filename = base + "_audio.mp4"
+    video_filename = base + "_video.mp4"
+    merged_filename = base + ".mp4"
+    merged_path = os.path.join(video_folder, merged_filename)
+    if mode == "audio":
+        final_path = os.path.join(video_folder, audio_filename)
+    else:
+        final_path = merged_path
+    if skip_existing and already_downloaded(final_path):
+        print(f"Already downloaded, skipping: {yt.title}")
+        return
+    ensure_folder(video_folder)
     
     if mode == "audio":
         stream = yt.streams.get_audio_only()
         if stream is None:
             print("No audio stream found!")
             return
-        filename = f"{safe_name(yt.title)}_audio.mp4"
         try:
-            stream.download(output_path=video_folder, filename=filename)
+            download_stream(stream, video_folder, audio_filename)
             print(f"Audio downloaded for: {yt.title}")
         except Exception as e:
             print("Error downloading audio:", e)
@@ -164,42 +700,172 @@ def download_single_video_auto(yt, mode, base_folder):
             print("Could not determine a valid stream for video download.")
             return
         
-        base = safe_name(yt.title)
         if decision == "progressive":
-            filename = f"{base}.mp4"
             try:
-                video_stream.download(output_path=video_folder, filename=filename)
+                download_stream(video_stream, video_folder, merged_filename)
                 print(f"Video downloaded (progressive) for: {yt.title}")
             except Exception as e:
                 print("Error downloading progressive video:", e)
         elif decision == "merge":
-            video_filename = f"{base}_video.mp4"
-            audio_filename = f"{base}_audio.mp4"
-            merged_filename = f"{base}.mp4"
-            video_path = os.path.join(video_folder, video_filename)
-            audio_path = os.path.join(video_folder, audio_filename)
-            merged_path = os.path.join(video_folder, merged_filename)
-            try:
-                print(f"Downloading video-only stream for: {yt.title}")
-                video_stream.download(output_path=video_folder, filename=video_filename)
-                print(f"Downloading audio stream for: {yt.title}")
-                audio_stream.download(output_path=video_folder, filename=audio_filename)
-            except Exception as e:
-                print("Error downloading streams:", e)
+            # FFmpeg writes here first so an interrupted merge never looks finished
+            partial_path = os.path.join(video_folder, base + ".part.mp4")
+            if audio_stream is None:
+                print("No audio stream found!")
                 return
-            print(f"Merging video and audio for: {yt.title}")
-            merge_video_audio(video_path, audio_path, merged_path)
-            # Remove temporary files
             try:
-                os.remove(video_path)
-                os.remove(audio_path)
-                print("Temporary files removed.")
+                # Let FFmpeg fetch and mux both streams in one pass; only download
+                # them separately when that fails (e.g. expired stream URLs)
+                print(f"Merging video and audio streams for: {yt.title}")
+                if merge_from_urls(
+                    video_stream.url, audio_stream.url, partial_path,
+                    audio_stream.audio_codec, yt.length, yt.title
+                ):
+                    os.replace(partial_path, merged_path)
+                    return
+                # Keep the intermediate files in a temporary directory (often tmpfs)
+                # that is removed automatically once the merge is done
+                with tempfile.TemporaryDirectory() as tmp_folder:
+                    video_path = os.path.join(tmp_folder, video_filename)
+                    audio_path = os.path.join(tmp_folder, audio_filename)
+                    # The two streams are independent, so fetch them at the same time
+                    print(f"Downloading video-only and audio streams for: {yt.title}")
+                    # Only one of them draws the progress bar, so report each when it's done
+                    with ThreadPoolExecutor(max_workers=2) as executor:
+                        futures = {
+                            executor.submit(download_stream, video_stream, tmp_folder, video_filename):
+                                "Video-only",
+                            executor.submit(download_stream, audio_stream, tmp_folder, audio_filename):
+                                "Audio",
+                        }
+                        for future in as_completed(futures):
+                            if future.exception() is None:
+                                print(f"{futures[future]} stream downloaded for: {yt.title}")
+                    try:
+                        for future in futures:
+                            future.result()
+                    except Exception as e:
+                        print("Error downloading streams:", e)
+                        return
+                    print(f"Merging video and audio for: {yt.title}")
+                    if merge_video_audio(video_path, audio_path, partial_path, audio_stream.audio_codec):
+                        os.replace(partial_path, merged_path)
             except Exception as e:
-                print("Error cleaning up temporary files:", e)
+                print("Error downloading/merging streams:", e)
+            finally:
+                # Whatever failed, don't leave a half-written merge behind
+                remove_quietly(partial_path)
     else:
         print("Invalid mode for auto download.")
 
-def download_playlist(playlist_url, mode, base_folder):
+def fetch_video(video_url, progress_bar=True):
+    """
+    Create the YouTube object for a playlist entry and fetch its metadata.
+    With progress_bar its downloads draw a progress bar, otherwise they print
+    status lines (see status_on_progress).
+    """
+    yt = YouTube(
+        video_url,
+        use_oauth=True,
+        allow_oauth_cache=True,
+        on_progress_callback=throttled_on_progress if progress_bar else status_on_progress
+    )
+    # pytubefix loads lazily; touch the title and streams so the requests happen here
+    yt.title
+    yt.streams
+    return yt
+
+def iter_playlist_videos(video_urls, existing_folders, progress_bar=True):
+    """
+    Yield (idx, yt, base, skip_existing) for every playlist video whose
+    YouTube object could be loaded, in playlist order.
+    
+    Metadata is prefetched by fetch_video in a sliding window of
+    METADATA_WORKERS videos ahead of the consumer. The window stays small
+    because the signed stream URLs expire after a few hours. The first
+    video is loaded on its own, so an OAuth login prompt appears only
+    once and the token is cached before the other workers start.
+    
+    Videos whose safe titles collide get their video id appended, so videos
+    downloaded in parallel never share files. Names are handed out in
+    playlist order, so a rerun gives every video the same folder again.
+    existing_folders holds the video folders that already existed in the
+    playlist folder; only videos listed there are checked for a previous download.
+    """
+    used_names = set()
+    pending = deque()
+    remaining_urls = iter(enumerate(video_urls, start=1))
+    
+    def submit_next():
+        for idx, video_url in remaining_urls:
+            pending.append((idx, video_url, executor.submit(fetch_video, video_url, progress_bar)))
+            return True
+        return False
+    
+    with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+        if submit_next():
+            wait([pending[0][2]])
+        while len(pending) < METADATA_WORKERS and submit_next():
+            pass
+        while pending:
+            idx, video_url, yt_future = pending.popleft()
+            submit_next()
+            try:
+                yt = yt_future.result()
+            except Exception as e:
+                print(f"Error initializing video {video_url}: {e}")
+                continue
+            base = safe_name(yt.title)
+            if base in used_names:
+                base = base[:255 - len(yt.video_id) - 1] + "_" + yt.video_id
+            used_names.add(base)
+            yield idx, yt, base, base in existing_folders
+
+def download_playlist_item(yt, idx, total, mode, pl_folder, base, skip_existing):
+    """
+    Download a single video of a playlist into pl_folder under the name base.
+    """
+    print(f"\n--- Video {idx}/{total}: {yt.title} ---")
+    if mode == "audio":
+        download_single_video_auto(yt, "audio", pl_folder, base, skip_existing)
+    elif mode == "video":
+        download_single_video_auto(yt, "video", pl_folder, base, skip_existing)
+    else:
+        print("Unknown mode for playlist download.")
+
+async def download_playlist_async(videos, total, mode, pl_folder):
+    """
+    Download the videos yielded by iter_playlist_videos concurrently, at most
+    MAX_PARALLEL at a time.
+    
+    pytubefix is synchronous, so every video is handled in a worker thread while
+    the semaphore bounds how many are in flight. The next video is only taken
+    from videos once a slot is free.
+    """
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(MAX_PARALLEL)
+    
+    async def _download_one(idx, yt, base, skip_existing):
+        try:
+            await loop.run_in_executor(
+                executor, download_playlist_item,
+                yt, idx, total, mode, pl_folder, base, skip_existing
+            )
+        finally:
+            sem.release()
+    
+    tasks = []
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as executor:
+        while True:
+            await sem.acquire()
+            # Taking the next video may wait on its metadata, so do it off the event loop
+            video = await loop.run_in_executor(None, next, videos, None)
+            if video is None:
+                sem.release()
+                break
+            tasks.append(asyncio.ensure_future(_download_one(*video)))
+        await asyncio.gather(*tasks)
+
+def download_playlist(playlist_url, mode, base_folder, force=False):
     """
     Download an entire playlist.
     
@@ -210,6 +876,8 @@ def download_playlist(playlist_url, mode, base_folder):
     
     Files are stored under:
       base_folder / <Safe_Playlist_Title> / <mode> / <Safe_Video_Title>/
+    
+    Videos that were already downloaded are skipped unless force is True.
     """
     try:
         pl = Playlist(playlist_url)
@@ -218,36 +886,37 @@ def download_playlist(playlist_url, mode, base_folder):
         return
     
     pl_title = pl.title if pl.title else "Untitled_Playlist"
-    pl_folder = os.path.join(base_folder, safe_name(pl_title), mode)
-    os.makedirs(pl_folder, exist_ok=True)
+    pl_folder = ensure_folder(os.path.join(base_folder, safe_name(pl_title), mode))
     
+    # pl.video_urls is evaluated lazily; resolve it once up front
+    video_urls = list(pl.video_urls)
     print(f"\nPlaylist Title: {pl.title}")
-    print(f"Total Videos: {len(pl.video_urls)}")
+    print(f"Total Videos: {len(video_urls)}")
     
-    for idx, video_url in enumerate(pl.video_urls, start=1):
-        print(f"\n--- Video {idx}/{len(pl.video_urls)} ---")
-        try:
-            yt = YouTube(
-                video_url,
-                use_oauth=True,
-                allow_oauth_cache=True,
-                on_progress_callback=on_progress
-            )
-        except Exception as e:
-            print(f"Error initializing video {video_url}: {e}")
-            continue
-        
-        print("Title:", yt.title)
-        if mode == "audio":
-            download_single_video_auto(yt, "audio", pl_folder)
-        elif mode == "video":
-            download_single_video_auto(yt, "video", pl_folder)
-        else:
-            print("Unknown mode for playlist download.")
+    # Snapshot the existing video folders once instead of stat'ing every item
+    existing_folders = set()
+    if not force:
+        existing_folders = {e.name for e in os.scandir(pl_folder) if e.is_dir()}
+    
+    # Metadata is prefetched in the background so that each download finds its
+    # YouTube object ready instead of waiting on a round-trip.
+    # Parallel downloads would overwrite each other's progress bar, so only
+    # sequential downloads draw one; the others print periodic status lines.
+    videos = iter_playlist_videos(video_urls, existing_folders, progress_bar=MAX_PARALLEL <= 1)
+    if MAX_PARALLEL <= 1:
+        for idx, yt, base, skip_existing in videos:
+            download_playlist_item(yt, idx, len(video_urls), mode, pl_folder, base, skip_existing)
+    else:
+        asyncio.run(download_playlist_async(videos, len(video_urls), mode, pl_folder))
 
 # --- Main Function ---
 
 def main():
+    parser = argparse.ArgumentParser(description="Download YouTube videos and playlists.")
+    parser.add_argument("--force", action="store_true",
+                        help="download again even if the file already exists")
+    args = parser.parse_args()
+    
     base_downloads = os.path.join(os.getcwd(), "downloads")
     os.makedirs(base_downloads, exist_ok=True)
     
@@ -266,7 +935,7 @@ def main():
                 video_url,
                 use_oauth=True,
                 allow_oauth_cache=True,
-                on_progress_callback=on_progress
+                on_progress_callback=throttled_on_progress
             )
         except Exception as e:
             print("Error initializing YouTube object:", e)
@@ -294,9 +963,9 @@ def main():
         if mode_choice == "m":
             download_single_video_manual(yt, base_downloads)
         elif mode_choice == "va":
-            download_single_video_auto(yt, "video", base_downloads)
+            download_single_video_auto(yt, "video", base_downloads, skip_existing=not args.force)
         elif mode_choice == "aa":
-            download_single_video_auto(yt, "audio", base_downloads)
+            download_single_video_auto(yt, "audio", base_downloads, skip_existing=not args.force)
         else:
             print("Invalid selection for single video.")
     
@@ -316,7 +985,7 @@ def main():
         else:
             print("Invalid selection.")
             return
-        download_playlist(playlist_url, mode, base_downloads)
+        download_playlist(playlist_url, mode, base_downloads, force=args.force)
     
     else:
         print("Invalid download type selection.")